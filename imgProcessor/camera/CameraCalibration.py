@@ -4,6 +4,7 @@ from six import string_types
 import numpy as np
 import pickle
 import time
+from bisect import bisect_right
 
 from imgProcessor.imgIO import imread
 from imgProcessor.camera.LensDistortion import LensDistortion
@@ -12,6 +13,13 @@ from imgProcessor.camera import NoiseLevelFunction
 from imgProcessor.filters.medianThreshold import medianThreshold
 from imgProcessor.imgSignal import signalStd
 
+try:
+    import bloscpack
+except Exception:
+    # not installed or broken
+    # (e.g. bloscpack<=0.16 fails with AttributeError on python>=3.10)
+    bloscpack = None
+
 
 DATE_FORMAT = "%d %b %y - %H:%M"  # e.g.: '30. Nov 15 - 13:20'
 
@@ -26,21 +34,28 @@ def _toDate(date):
 #     return np.argmax([time.mktime(t) for t in dates])
 
 
-def _insertDateIndex(date, l):
+def _dateKey(date):
+    # negative, because calibration lists are sorted newest first
+    return -time.mktime(date)
+
+
+def _insertDateIndex(date, keys):
     '''
-    returns the index to insert the given date in a list
-    where each items first value is a date
+    returns the index to insert the given date in a calibration list
+    given its sorted date keys, see CameraCalibration._dateKeys
     '''
-    return next((i for i, n in enumerate(l) if n[0] < date), len(l))
+    if isinstance(keys, np.ndarray):
+        return int(np.searchsorted(keys, _dateKey(date), side='right'))
+    return bisect_right(keys, _dateKey(date))
 
 
-def _getFromDate(l, date):
+def _getFromDate(l, keys, date):
     '''
     returns the index of given or best fitting date
     '''
     try:
         date = _toDate(date)
-        i = _insertDateIndex(date, l) - 1
+        i = _insertDateIndex(date, keys) - 1
         if i == -1:
             return l[0]
         return l[i]
@@ -49,6 +64,128 @@ def _getFromDate(l, date):
         return l[0]
 
 
+class _CoeffSeries(object):
+    '''
+    Calibrations of one type, sorted newest first and stored
+    as separate sequences of dates, infos, data and errors
+
+    indexing and iterating return (date, info, data, error)
+    like the calibration lists of the other types
+
+    .keys (sorted date keys for lookup) are derived from .dates
+    in local time, so they are not pickled but rebuilt on load
+    '''
+
+    def __init__(self, items=()):
+        self.keys = np.empty(0)
+        self.dates = []
+        self.infos = []
+        self.data = []
+        self.errors = []
+        for item in items:
+            self.insert(len(self), item)
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        del d['keys']
+        return d
+
+    def __setstate__(self, d):
+        d = dict(d)
+        keys = d.pop('keys', None)
+        if 'dates' not in d:
+            # saved before dates were stored
+            d['dates'] = [time.localtime(-k) for k in keys]
+        self.__dict__.update(d)
+        self.keys = np.array([_dateKey(date) for date in self.dates],
+                             dtype=float)
+
+    def __len__(self):
+        return len(self.infos)
+
+    def __getitem__(self, i):
+        return (self.dates[i], self.infos[i],
+                self.data[i], self.errors[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def insert(self, i, item):
+        date, info, data, error = item
+        self.keys = np.insert(self.keys, i, _dateKey(date))
+        self.dates.insert(i, date)
+        self.infos.insert(i, info)
+        self.data.insert(i, data)
+        self.errors.insert(i, error)
+
+    def pop(self, i):
+        item = self[i]
+        self.keys = np.delete(self.keys, i)
+        self.dates.pop(i)
+        self.infos.pop(i)
+        self.data.pop(i)
+        self.errors.pop(i)
+        return item
+
+
+_restoration = {}
+
+
+def _restorationFn(name):
+    '''
+    returns a function of skimage.restoration
+    skimage is imported on first use only to save startup time
+    '''
+    try:
+        return _restoration[name]
+    except KeyError:
+        from skimage.restoration import denoise_nl_means
+        from skimage.restoration.deconvolution import unsupervised_wiener, wiener
+        _restoration.update(denoise_nl_means=denoise_nl_means,
+                            unsupervised_wiener=unsupervised_wiener,
+                            wiener=wiener)
+        return _restoration[name]
+
+
+def _packArrays(item, arrays):
+    '''
+    returns a copy of [item] where every numerical array is appended to
+    [arrays] and replaced by the placeholder {'__bp__': index}
+    '''
+    if isinstance(item, np.ndarray):
+        if item.dtype == object or not item.size:
+            return item
+        arrays.append(item)
+        return {'__bp__': len(arrays) - 1}
+    if isinstance(item, _CoeffSeries):
+        out = _CoeffSeries()
+        out.__setstate__(_packArrays(item.__getstate__(), arrays))
+        return out
+    if type(item) == dict:
+        return {k: _packArrays(v, arrays) for k, v in item.items()}
+    if type(item) in (list, tuple):
+        return type(item)(_packArrays(it, arrays) for it in item)
+    return item
+
+
+def _unpackArrays(item, arrays):
+    '''
+    inverse of _packArrays
+    '''
+    if isinstance(item, _CoeffSeries):
+        out = _CoeffSeries()
+        out.__setstate__(_unpackArrays(item.__getstate__(), arrays))
+        return out
+    if type(item) == dict:
+        if len(item) == 1 and '__bp__' in item:
+            return arrays[item['__bp__']]
+        return {k: _unpackArrays(v, arrays) for k, v in item.items()}
+    if type(item) in (list, tuple):
+        return type(item)(_unpackArrays(it, arrays) for it in item)
+    return item
+
+
 class CameraCalibration(object):
     '''
     Collect a arrays and parameters needed for camera calibration (.add###)
@@ -66,13 +203,13 @@ class CameraCalibration(object):
             'depth': 16,
             # available light spectra e.g. ['light', 'IR']
             'light spectra': [],
-            # [ [date, [slope, intercept], info, (error)],[...] ]
-            'dark current': [],
+            # (date, info, (slope, intercept), (error)), ...
+            'dark current': _CoeffSeries(),
             'flat field': {},  # {light:[[date, info, array, (error)],[...] ]
             # {light:[[ date, info, LensDistortion]         ,[...] ]
             'lens': {},
-            # [ [date, info, NoiseLevelFunction]            ,[...] ]
-            'noise': [],
+            # (date, info, NoiseLevelFunction, (error)), ...
+            'noise': _CoeffSeries(),
             'psf': {},
             'shape': None,
             # factor sharpness/smoothness of image used for wiener
@@ -80,6 +217,21 @@ class CameraCalibration(object):
             'balance': {}
         }
         self.temp = {}
+        # same as self.coeffs['shape'], see ._checkShape
+        self._shape = None
+        # {(typ, light): (calibration list, [date keys parallel to it])}
+        self._date_keys = {}
+        # {(name, light, date): result of .getCoeff}
+        self._coeff_cache = {}
+        # {(id(flat field), dtype): (flat field, 1/flat field)}
+        self._ff_inv = {}
+
+    def _clearCache(self):
+        '''
+        to be called, whenever calibrations are added, removed or changed
+        '''
+        self._coeff_cache.clear()
+        self._ff_inv.clear()
 
     def _getDate(self, typ, light):
         d = self.coeffs[typ]
@@ -88,6 +240,41 @@ class CameraCalibration(object):
             d = d[light]
         return d
 
+    def _dateKeys(self, typ, light, l):
+        '''
+        returns the sorted date keys of calibration list [l]
+        rebuilding them, if [l] was replaced or resized from outside
+        '''
+        if isinstance(l, _CoeffSeries):
+            return l.keys
+        if type(self.coeffs[typ]) is not dict:
+            light = None
+        try:
+            l0, k = self._date_keys[(typ, light)]
+            if l0 is l and len(k) == len(l):
+                return k
+        except KeyError:
+            pass
+        k = [_dateKey(n[0]) for n in l]
+        self._date_keys[(typ, light)] = (l, k)
+        return k
+
+    def _insertCoeff(self, typ, light, date, item):
+        '''
+        insert [item] into calibration list of [typ] sorted by [date]
+        '''
+        l = self.coeffs[typ]
+        if light is not None:
+            if light not in l:
+                l[light] = []
+            l = l[light]
+        keys = self._dateKeys(typ, light, l)
+        i = _insertDateIndex(date, keys)
+        self._clearCache()
+        l.insert(i, item)
+        if not isinstance(l, _CoeffSeries):
+            keys.insert(i, _dateKey(date))
+
     def dates(self, typ, light=None):
         '''
         Args:
@@ -116,7 +303,7 @@ class CameraCalibration(object):
         if date is None:
             return [c[1] for c in d]
         # TODO: not struct time, but time in ms since epoch
-        return _getFromDate(d, date)[1]
+        return _getFromDate(d, self._dateKeys(typ, light, d), date)[1]
 
     def overview(self):
         '''
@@ -184,7 +371,8 @@ class CameraCalibration(object):
         self.coeffs['name'] = camera_name
         self.coeffs['depth'] = bit_depth
 
-    def addDarkCurrent(self, slope, intercept=None, date=None, info='', error=None):
+    def addDarkCurrent(self, slope, intercept=None, date=None, info='', error=None,
+                       dtype=np.float32):
         '''
         Args:
             slope (np.array)
@@ -193,18 +381,26 @@ class CameraCalibration(object):
             slope (float): dPx/dExposureTime[sec]
             error (float): absolute
             date (str): "DD Mon YY" e.g. "30 Nov 16"
+            dtype: slope and intercept arrays are stored as [dtype]
+                   set to None to keep the given precision
         '''
         date = _toDate(date)
 
         self._checkShape(slope)
         self._checkShape(intercept)
 
-        d = self.coeffs['dark current']
+        if dtype is not None:
+            if isinstance(slope, np.ndarray):
+                slope = slope.astype(dtype, copy=False)
+            if isinstance(intercept, np.ndarray):
+                intercept = intercept.astype(dtype, copy=False)
+
         if intercept is None:
             data = slope
         else:
             data = (slope, intercept)
-        d.insert(_insertDateIndex(date, d), [date, info, data, error])
+        self._insertCoeff('dark current', None, date,
+                          [date, info, data, error])
 
     def addNoise(self, nlf_coeff, date=None, info='', error=None):
         '''
@@ -215,19 +411,15 @@ class CameraCalibration(object):
             date (str): "DD Mon YY" e.g. "30 Nov 16"
         '''
         date = _toDate(date)
-        d = self.coeffs['noise']
-        d.insert(_insertDateIndex(date, d), [date, info, nlf_coeff, error])
+        self._insertCoeff('noise', None, date,
+                          [date, info, nlf_coeff, error])
 
     def addDeconvolutionBalance(self, balance, date=None, info='',
                                 light_spectrum='visible'):
         self._registerLight(light_spectrum)
         date = _toDate(date)
-
-        f = self.coeffs['balance']
-        if light_spectrum not in f:
-            f[light_spectrum] = []
-        f[light_spectrum].insert(_insertDateIndex(date, f[light_spectrum]),
-                                 [date, info, balance])
+        self._insertCoeff('balance', light_spectrum, date,
+                          [date, info, balance])
 
     def addPSF(self, psf, date=None, info='', light_spectrum='visible'):
         '''
@@ -235,19 +427,20 @@ class CameraCalibration(object):
         '''
         self._registerLight(light_spectrum)
         date = _toDate(date)
-
-        f = self.coeffs['psf']
-        if light_spectrum not in f:
-            f[light_spectrum] = []
-        f[light_spectrum].insert(_insertDateIndex(date, f[light_spectrum]),
-                                 [date, info, psf])
+        self._insertCoeff('psf', light_spectrum, date,
+                          [date, info, psf])
 
     def _checkShape(self, array):
-        if not isinstance(array, np.ndarray):
-            return
-        s = self.coeffs['shape']
+        if isinstance(array, np.ndarray):
+            self._checkShapeFast(array)
+
+    def _checkShapeFast(self, array):
+        '''
+        same as ._checkShape, but [array] has to be a np.ndarray
+        '''
+        s = self._shape
         if s is None:
-            self.coeffs['shape'] = array.shape
+            self._shape = self.coeffs['shape'] = array.shape
         elif s[:2] != array.shape[:2]:
             raise Exception("""array shapes are different: stored(%s), given(%s)
 if shapes are transposed, execute self.transpose() once """ % (s, array.shape))
@@ -258,13 +451,10 @@ if shapes are transposed, execute self.transpose() once """ % (s, array.shape))
         light_spectrum = light, IR ...
         '''
         self._registerLight(light_spectrum)
-        self._checkShape(arr)
+        self._checkShapeFast(arr)
         date = _toDate(date)
-        f = self.coeffs['flat field']
-        if light_spectrum not in f:
-            f[light_spectrum] = []
-        f[light_spectrum].insert(_insertDateIndex(date, f[light_spectrum]),
-                                 [date, info, arr, error])
+        self._insertCoeff('flat field', light_spectrum, date,
+                          [date, info, arr, error])
 
     def addLens(self, lens, date=None, info='', light_spectrum='visible'):
         '''
@@ -278,24 +468,24 @@ if shapes are transposed, execute self.transpose() once """ % (s, array.shape))
             l.readFromFile(lens)
             lens = l
 
-        f = self.coeffs['lens']
-        if light_spectrum not in f:
-            f[light_spectrum] = []
-        f[light_spectrum].insert(_insertDateIndex(date, f[light_spectrum]),
-                                 [date, info, lens.coeffs])
+        self._insertCoeff('lens', light_spectrum, date,
+                          [date, info, lens.coeffs])
 
     def clearOldCalibrations(self, date=None):
         '''
         if not only a specific date than remove all except of the youngest calibration
         '''
-        self.coeffs['dark current'] = [self.coeffs['dark current'][-1]]
-        self.coeffs['noise'] = [self.coeffs['noise'][-1]]
+        self.coeffs['dark current'] = _CoeffSeries(
+            [self.coeffs['dark current'][-1]])
+        self.coeffs['noise'] = _CoeffSeries([self.coeffs['noise'][-1]])
+        self._clearCache()
 
         for light in self.coeffs['flat field']:
             self.coeffs['flat field'][light] = [
                 self.coeffs['flat field'][light][-1]]
         for light in self.coeffs['lens']:
             self.coeffs['lens'][light] = [self.coeffs['lens'][light][-1]]
+        self._date_keys.clear()
 
     def _correctPath(self, path):
         if not path.endswith(self.ftype):
@@ -312,12 +502,43 @@ if shapes are transposed, execute self.transpose() once """ % (s, array.shape))
             # for py2 pickels, the following works:
             with open(path, 'rb') as f:
                 d = pickle.load(f, encoding='latin1')
+        packed = d.pop('__bp__', None)
+        if packed is not None:
+            # arrays are stored blosc compressed, see .saveToFile
+            if bloscpack is None:
+                raise ImportError(
+                    'bloscpack is needed to read calibration %s' % path)
+            arrays = [bloscpack.unpack_ndarray_from_bytes(b)
+                      for b in packed]
+            d = _unpackArrays(d, arrays)
+        for typ in ('dark current', 'noise'):
+            if type(d.get(typ)) == list:
+                # saved before these were stored as _CoeffSeries
+                d[typ] = _CoeffSeries(d[typ])
         cal.coeffs.update(d)
+        cal._shape = cal.coeffs['shape']
         return cal
 
-    def saveToFile(self, path):
+    def saveToFile(self, path, cname='lz4', compress=True):
+        '''
+        if bloscpack is installed and [compress] is True,
+        all calibration arrays are compressed using blosc
+        (cname e.g. 'lz4' or 'zstd')
+        only the remaining structure is pickled
+        
+        NOTE: a compressed calibration can only be loaded
+              with bloscpack installed, use compress=False otherwise
+        '''
         path = self._correctPath(path)
-        c = dict(self.coeffs)
+        c = self.coeffs
+        if compress and bloscpack is not None:
+            arrays = []
+            # (returns a copy, so self.coeffs stays unchanged)
+            c = _packArrays(c, arrays)
+            args = bloscpack.BloscArgs(cname=cname)
+            c['__bp__'] = [bloscpack.pack_ndarray_to_bytes(
+                np.ascontiguousarray(a), blosc_args=args)
+                for a in arrays]
         with open(path, 'wb') as outfile:
             pickle.dump(c, outfile, protocol=pickle.HIGHEST_PROTOCOL)
 
@@ -340,13 +561,17 @@ if shapes are transposed, execute self.transpose() once """ % (s, array.shape))
         s = self.coeffs['shape']
 
         for item in self.coeffs.values():
-            if type(item) == dict:
+            if isinstance(item, _CoeffSeries):
+                _t(item.data)
+                _t(item.errors)
+            elif type(item) == dict:
                 for item2 in item.values():
                     _t(item2)
             else:
                 _t(item)
 
-        self.coeffs['shape'] = s[::-1]
+        self._shape = self.coeffs['shape'] = s[::-1]
+        self._clearCache()
 
     def correct(self, images,
                 bgImages=None,
@@ -356,9 +581,12 @@ if shapes are transposed, execute self.transpose() once """ % (s, array.shape))
                 keep_size=True,
                 date=None,
                 deblur=False,
-                denoise=False):
+                denoise=False,
+                dtype=np.float32):
         '''
         exposure_time [s]
+        dtype -> precision of the corrected image
+                 float32 is sufficient for up to 24 bit sensors
 
         date -> string e.g. '30. Nov 15' to get a calibration on from date
              -> {'dark current':'30. Nov 15',
@@ -392,7 +620,7 @@ if shapes are transposed, execute self.transpose() once """ % (s, array.shape))
                 # 0.NOISE
                 n = self.coeffs['noise']
                 if self.noise_level_function is None and len(n):
-                    n = _getFromDate(n, date['noise'])[2]
+                    n = self.getCoeff('noise', date=date['noise'])[2]
                     self.noise_level_function = lambda x: NoiseLevelFunction.boundedFunction(
                         x, *n)
 
@@ -405,11 +633,11 @@ if shapes are transposed, execute self.transpose() once """ % (s, array.shape))
                 if self.noise_level_function is None:
                     self.noise_level_function = ste.noise_level_function
             else:
-                image = np.asfarray(imread(images[0], dtype=np.float))
+                image = np.asarray(imread(images[0], dtype=dtype), dtype=dtype)
         else:
-            image = np.asfarray(imread(images, dtype=np.float))
+            image = np.asarray(imread(images, dtype=dtype), dtype=dtype)
 
-        self._checkShape(image)
+        self._checkShapeFast(image)
 
         self.last_light_spectrum = light_spectrum
         self.last_img = image
@@ -463,8 +691,8 @@ if shapes are transposed, execute self.transpose() once """ % (s, array.shape))
         denoise using non-local-means
         with guessing best parameters
         '''
-        from skimage.restoration import denoise_nl_means  # save startup time
         image[np.isnan(image)] = 0  # otherwise result =nan
+        denoise_nl_means = _restorationFn('denoise_nl_means')
         out = denoise_nl_means(image,
                                patch_size=7,
                                patch_distance=11,
@@ -498,42 +726,54 @@ if shapes are transposed, execute self.transpose() once """ % (s, array.shape))
                 bg = imread(bgImages)
         else:
             bg = self.calcDarkCurrent(exposuretime, date)
+        bg = np.asarray(bg)
+        if bg.dtype != image.dtype:
+            # avoid a temporary array of the mixed type:
+            bg = bg.astype(image.dtype, copy=False)
         self.temp['bg'] = bg
-        image -= bg
+        np.subtract(image, bg, out=image)
 
     def calcDarkCurrent(self, exposuretime, date=None):
-        d = self.coeffs['dark current']
-        d = _getFromDate(d, date)
-        if type(d) == tuple:
+        d = self.getCoeff('dark current', date=date)
+        if type(d[2]) in (tuple, list):
             # calculate bg image:
-            offs, ascent = d[2]
-            bg = offs + ascent * exposuretime
+            ascent, offs = d[2]
+            # in the precision of the stored calibration (at least float32):
+            dtype = np.result_type(ascent, offs, np.float32)
+            bg = np.multiply(ascent, exposuretime, dtype=dtype)
+            bg += offs
             mx = 2**self.coeffs['depth'] - 1  # maximum value
-            with np.errstate(invalid='ignore'):
-                bg[bg > mx] = mx
+            np.minimum(bg, mx, out=bg)
         else:
             # only constant bg value of array given
             bg = d[2]
 
-        return bg
+        return np.asarray(bg)
 
     def _correctVignetting(self, image, light_spectrum, date):
         d = self.getCoeff('flat field', light_spectrum, date)
         if d is not None:
             print('... remove vignetting and sensitivity')
-            d = d[2]
-            i = d != 0
-            image[i] /= d[i]
-#         with np.errstate(divide='ignore'):
-#             out = image / d
-#         #set
-#         out[i]=image[i]
-        # return image
+            np.multiply(image, self._invFlatField(d[2], image.dtype),
+                        out=image)
 
-    def _correctBlur(self, image, light_spectrum, date):
-        # save startup time
-        from skimage.restoration.deconvolution import unsupervised_wiener, wiener
+    def _invFlatField(self, arr, dtype):
+        '''
+        returns 1/[arr] (1 where arr==0) as [dtype]
+        cached, since the same flat field is used for many images
+        '''
+        key = (id(arr), np.dtype(dtype))
+        try:
+            a, inv = self._ff_inv[key]
+            if a is arr:
+                return inv
+        except KeyError:
+            pass
+        inv = (1.0 / np.where(arr != 0, arr, 1.0)).astype(dtype, copy=False)
+        self._ff_inv[key] = (arr, inv)
+        return inv
 
+    def _correctBlur(self, image, light_spectrum, date):
         d = self.getCoeff('psf', light_spectrum, date)
         if not d:
             print('skip deconvolution // no PSF set')
@@ -546,21 +786,32 @@ if shapes are transposed, execute self.transpose() once """ % (s, array.shape))
         if balance is None:
             print(
                 'no balance value for wiener deconvolution found // use unsupervised_wiener instead // this will take some time')
-            deconvolved, _ = unsupervised_wiener(image, psf)
+            deconvolved, _ = _restorationFn('unsupervised_wiener')(image, psf)
         else:
-            deconvolved = wiener(image, psf, balance[2])
+            deconvolved = _restorationFn('wiener')(image, psf, balance[2])
         deconvolved[deconvolved < 0] = 0
         deconvolved *= mx
         return deconvolved
 
-    def _correctArtefacts(self, image, threshold):
+    def _correctArtefacts(self, image, threshold, tile=256):
         '''
         Apply a thresholded median replacing high gradients 
         and values beyond the boundaries
         '''
-        image = np.nan_to_num(image)
-        medianThreshold(image, threshold, copy=False)
-        return image
+        # process in tiles, that fit into the cpu cache
+        # + a border of 1px, needed by the 3x3 median filter:
+        s0, s1 = image.shape[:2]
+        out = np.empty_like(image)
+        for y0 in range(0, s0, tile):
+            y1 = min(y0 + tile, s0)
+            b0, b1 = max(y0 - 1, 0), min(y1 + 1, s0)
+            for x0 in range(0, s1, tile):
+                x1 = min(x0 + tile, s1)
+                c0, c1 = max(x0 - 1, 0), min(x1 + 1, s1)
+                t = np.nan_to_num(image[b0:b1, c0:c1])
+                medianThreshold(t, threshold, copy=False)
+                out[y0:y1, x0:x1] = t[y0 - b0:y1 - b0, x0 - c0:x1 - c0]
+        return out
 
     def getLens(self, light_spectrum, date):
         d = self.getCoeff('lens', light_spectrum, date)
@@ -575,15 +826,20 @@ if shapes are transposed, execute self.transpose() once """ % (s, array.shape))
         return image
 
     def deleteCoeff(self, name, date, light=None):
-        try:
-            c = self.coeffs[name][light]
-        except TypeError:
+        c = self.coeffs[name]
+        if type(c) is not dict:
             # not light dependent
-            c = self.coeffs[name]
+            light = None
+        else:
+            c = c[light]
+        keys = self._dateKeys(name, light, c)
         d = _toDate(date)
-        i = _insertDateIndex(d, c) - 1
+        i = _insertDateIndex(d, keys) - 1
         if i != -1:
+            self._clearCache()
             c.pop(i)
+            if not isinstance(c, _CoeffSeries):
+                keys.pop(i)
         else:
             raise Exception('no coeff %s for date %s' % (name, date))
 
@@ -591,24 +847,36 @@ if shapes are transposed, execute self.transpose() once """ % (s, array.shape))
         '''
         try to get calibration for right light source, but
         use another if they is none existent
-        '''
-        d = self.coeffs[name]
 
+        results are cached until calibrations are added or removed
+        '''
+        key = (name, light, date)
         try:
-            c = d[light]
+            return self._coeff_cache[key]
         except KeyError:
-            try:
-                k, i = next(iter(d.items()))
-                if light is not None:
-                    print(
-                        'no calibration found for [%s] - using [%s] instead' % (light, k))
-            except StopIteration:
-                return None
-            c = i
-        except TypeError:
+            pass
+        d = self.coeffs[name]
+
+        if type(d) is not dict:
             # coeff not dependent on light source
             c = d
-        return _getFromDate(c, date)
+            light = None
+        else:
+            try:
+                c = d[light]
+            except KeyError:
+                try:
+                    k, i = next(iter(d.items()))
+                    if light is not None:
+                        print(
+                            'no calibration found for [%s] - using [%s] instead' % (light, k))
+                except StopIteration:
+                    return None
+                c = i
+                light = k
+        out = _getFromDate(c, self._dateKeys(name, light, c), date)
+        self._coeff_cache[key] = out
+        return out
 
     def uncertainty(self, img=None, light_spectrum=None):
         # TODO: review
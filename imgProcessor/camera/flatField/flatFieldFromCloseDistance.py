@@ -100,17 +100,14 @@ if __name__ == '__main__':
     import sys
     from time import time
     from matplotlib import pyplot as plt
-    from imgProcessor.equations.vignetting import vignetting
+    from imgProcessor.equations.vignetting import vignetting_image
 
     # make 10 vignetting arrays with slightly different optical centre
     # to simulate effects that occur when vignetting is measured badly
     d = np.linspace(-20, 20, 100)
     bg = np.random.rand(100, 100) * 10
-    vigs = [np.fromfunction(
-            # vignetting from function
-            lambda x, y:
-            vignetting((x, y), cx=50 - di, cy=50 + di),
-            (100, 100)) * 100 +
+    # vignetting from function:
+    vigs = [vignetting_image((100, 100), cx=50 + di, cy=50 - di) * 100 +
             # add noise
             np.random.rand(100, 100) * 10
             for di in d]
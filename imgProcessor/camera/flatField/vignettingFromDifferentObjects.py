@@ -2,9 +2,11 @@
 from __future__ import division
 from __future__ import print_function
 
+import os
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
-from scipy.ndimage.filters import gaussian_filter, minimum_filter
+from scipy.ndimage.filters import gaussian_filter, minimum_filter, uniform_filter
 from skimage.transform import rescale
 
 from fancytools.math.MaskedMovingAverage import MaskedMovingAverage
@@ -14,7 +16,16 @@ from imgProcessor.measure.FitHistogramPeaks import FitHistogramPeaks
 from imgProcessor.imgSignal import getSignalMinimum
 
 from imgProcessor.utils.getBackground import getBackground
-from imgProcessor.filters.maskedFilter import maskedFilter
+
+
+def _blockMean(img, k):
+    '''
+    down scale [img] by averaging blocks of k*k px
+    remaining rows and columns are cropped
+    '''
+    s0, s1 = img.shape[0] // k, img.shape[1] // k
+    img = img[:s0 * k, :s1 * k]
+    return img.reshape(s0, k, s1, k).mean(axis=(1, 3))
 
 
 class FlatFieldFromImgFit(object):
@@ -38,20 +49,31 @@ class FlatFieldFromImgFit(object):
 #         self._m = None
         self._small_shape = None
         self._first = True
+        self._down = None  # integer down scale factor
 
         self.bg = getBackground(bg_images)
 
-        if images is not None:
-            for n, i in enumerate(images):
-                print('%s/%s' % (n + 1, len(images)))
-                self.addImg(i)
+        if images is not None and len(images):
+            n = len(images)
+            print('1/%s' % n)
+            # first image determines scale factor and kernel size:
+            self.addImg(images[0])
+            # read and process all others in parallel
+            # only the moving average is updated one after another:
+            with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+                for k, res in enumerate(ex.map(self._process, images[1:])):
+                    print('%s/%s' % (k + 2, n))
+                    self._update(res)
 
     def _firstImg(self, img):
 
         if self.scale_factor is None:
             # determine so that smaller image size has 50 px
             self.scale_factor = 100 / min(img.shape)
-        img = rescale(img, self.scale_factor)
+        down = 1 / self.scale_factor
+        if down > 1 and abs(down - round(down)) < 1e-6:
+            self._down = int(round(down))
+        img = self._rescale(img)
 
         self._m = MaskedMovingAverage(shape=img.shape)
         if self.ksize is None:
@@ -59,6 +81,12 @@ class FlatFieldFromImgFit(object):
         self._first = False
         return img
 
+    def _rescale(self, img):
+        if self._down is not None:
+            # fast path for integer down scaling:
+            return _blockMean(img, self._down)
+        return rescale(img, self.scale_factor)
+
     def _read(self, img):
         img = imread(img, 'gray', dtype=float)
         img -= self.bg
@@ -75,20 +103,36 @@ class FlatFieldFromImgFit(object):
 #         return minimum_filter(self._m.n>0,self.ksize)
 
     def addImg(self, i):
-        img = self._read(i)
+        self._update(self._process(i))
 
-        if self._first:
-            img = self._firstImg(img)
-        elif self.scale_factor != 1:
-            img = rescale(img, self.scale_factor)
+    def _process(self, i):
+        '''
+        read, scale and blur given image
+        returns (blurred image, signal indices, min, max)
+        or None, if image could not be processed
+        '''
+        img = self._read(i)
+        # fit histogram of the full resolution image
+        # (big images are subsampled within FitHistogramPeaks)
+        # so images that cannot be fitted are not rescaled:
         try:
             f = FitHistogramPeaks(img)
         except AssertionError:
-            return
+            f = None
+
+        if self._first:
+            img = self._firstImg(img)
+        elif f is not None and self.scale_factor != 1:
+            img = self._rescale(img)
+        if f is None:
+            return None
         #sp = getSignalPeak(f.fitParams)
         mn = getSignalMinimum(f.fitParams)
         # non-backround indices:
         ind = img > mn  # sp[1] - self.nstd * sp[2]
+        if not ind.any():
+            # no signal pixels - skip image
+            return None
         # blur:
         # blurred = minimum_filter(img, 3)#remove artefacts
         #blurred = maximum_filter(blurred, self.ksize)
@@ -96,22 +140,33 @@ class FlatFieldFromImgFit(object):
 #         gblurred = gaussian_filter(img, self.ksize)
 #         ind = minimum_filter(ind, self.ksize)
         nind = np.logical_not(ind)
-        gblurred = maskedFilter(img, nind, ksize=2 * self.ksize,
-                                fill_mask=False,
-                                fn="mean")
+        # masked mean filter = sum(signal px) / n(signal px) within kernel:
+        # (same as maskedFilter(img, nind, 2*ksize, fill_mask=False, fn='mean'))
+        find = ind.astype(img.dtype)
+        num = uniform_filter(img * find, 2 * self.ksize, mode='constant')
+        den = uniform_filter(find, 2 * self.ksize, mode='constant')
+        gblurred = np.full_like(img, np.nan)
+        gblurred[ind] = num[ind] / den[ind]
 
         #blurred[ind] = gblurred[ind]
         # scale [0-1]:
-        mn = img[nind].mean()
+        # (reduce using where=, to not create masked copies)
+        n = np.count_nonzero(nind)
+        mn = img.sum(where=nind) / n if n else 0
         if np.isnan(mn):
             mn = 0
-        mx = gblurred[ind].max()
+        mx = gblurred.max(where=ind, initial=-np.inf)
         gblurred -= mn
         gblurred /= (mx - mn)
 #         img -= mn
 #         img /= (mx - mn)
 #         ind = np.logical_and(ind, img > self._m.avg)
+        return gblurred, ind, mn, mx
 
+    def _update(self, res):
+        if res is None:
+            return
+        gblurred, ind, mn, mx = res
         self._m.update(gblurred, ind)
         self.bglevel.append(mn)
         self._mx += mx
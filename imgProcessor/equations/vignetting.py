@@ -1,12 +1,39 @@
 from __future__ import division
 import numpy as np
+from functools import lru_cache
+from math import sqrt, sin, cos, tan
+from numba import njit, prange
+
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
+
+
+# vignetting() as single expression to be evaluated with numexpr:
+_VIGNETTING_EXPR = ('(1 - alpha * sqrt((x - cx)**2 + (y - cy)**2))'
+                    ' * ct * (1 + tf * (x * sr - y * cr))**3'
+                    ' / (1 + ((x - cx)**2 + (y - cy)**2) * iff)**2')
 
 
 def guessVignettingParam(shape):
     return (shape[0] * 0.7, 0, 0, 0, shape[0] / 2, shape[1] / 2)
 
 
-def vignetting(xy, f=100, alpha=0, rot=0, tilt=0, cx=50, cy=50):
+@lru_cache(maxsize=8)
+def _coords(shape):
+    '''
+    returns read-only, broadcastable (x, y) coordinate arrays
+    for a given image shape
+    '''
+    y, x = np.ogrid[:shape[0], :shape[1]]
+    x.setflags(write=False)
+    y.setflags(write=False)
+    return x, y
+
+
+def vignetting(xy=None, f=100, alpha=0, rot=0, tilt=0, cx=50, cy=50,
+               shape=None):
     '''
     Vignetting equation using the KANG-WEISS-MODEL
     see http://research.microsoft.com/en-us/um/people/sbkang/publications/eccv00.pdf   
@@ -17,8 +44,18 @@ def vignetting(xy, f=100, alpha=0, rot=0, tilt=0, cx=50, cy=50):
     rot - rotation angle of a planar scene
     cx - image center, x
     cy - image center, y
+    shape - evaluate on the whole image of given shape, if [xy] is None
     '''
-    x, y = xy
+    if xy is None:
+        x, y = _coords(tuple(shape))
+    else:
+        x, y = xy
+    if ne is not None:
+        # evaluate all factors in one multi-threaded loop:
+        return ne.evaluate(_VIGNETTING_EXPR, local_dict={
+            'x': x, 'y': y, 'cx': cx, 'cy': cy, 'alpha': alpha,
+            'iff': 1.0 / (f * f), 'ct': np.cos(tilt),
+            'tf': np.tan(tilt) / f, 'sr': np.sin(rot), 'cr': np.cos(rot)})
     # distance to image center:
     dist = ((x - cx)**2 + (y - cy)**2)**0.5
 
@@ -37,6 +74,66 @@ def vignetting(xy, f=100, alpha=0, rot=0, tilt=0, cx=50, cy=50):
     return A * G * T
 
 
+def vignetting_image(shape, f=100, alpha=0, rot=0, tilt=0, cx=50, cy=50):
+    '''
+    Same as vignetting, but evaluated on a whole image of given [shape]
+
+    the coordinates are broadcasted from 1d arrays (np.ogrid),
+    so temporaries stay small until the final multiplication
+    '''
+    x, y = _coords(tuple(shape))
+    dx = x - cx
+    dy = y - cy
+    d2 = dx * dx + dy * dy
+    # OFF_AXIS ILLUMINATION FACTOR:
+    out = 1.0 / (1 + d2 / (f * f))**2
+    # GEOMETRIC FACTOR:
+    if alpha != 0:
+        out *= 1 - alpha * np.sqrt(d2)
+    # TILT FACTOR:
+    if tilt != 0:
+        ct = np.cos(tilt)
+        tf = np.tan(tilt) / f
+        sr, cr = np.sin(rot), np.cos(rot)
+        out *= ct * (1 + tf * (x * sr - y * cr))**3
+    return out
+
+
+def vignetting_numba(shape, f=100, alpha=0, rot=0, tilt=0, cx=50, cy=50,
+                     out=None):
+    '''
+    Same as vignetting_image, but computed in a single parallel loop
+    writing into [out]
+
+    pass the same [out] array to repeated calls (e.g. within a fit)
+    to avoid allocating a new image every time
+    '''
+    if out is None:
+        out = np.empty(shape, dtype=np.float64)
+    _vignetting_numba(out, shape[0], shape[1], float(f), float(alpha),
+                      float(rot), float(tilt), float(cx), float(cy))
+    return out
+
+
+@njit('void(f8[:,:], i8, i8, f8, f8, f8, f8, f8, f8)',
+      parallel=True, fastmath=True, cache=True)
+def _vignetting_numba(out, H, W, f, alpha, rot, tilt, cx, cy):
+    iff = 1.0 / (f * f)
+    ct = cos(tilt)
+    tf = tan(tilt) / f
+    sr = sin(rot)
+    cr = cos(rot)
+    for y in prange(H):
+        for x in range(W):
+            dx = x - cx
+            dy = y - cy
+            d2 = dx * dx + dy * dy
+            A = 1.0 / (1 + d2 * iff)**2
+            G = 1 - alpha * sqrt(d2)
+            T = ct * (1 + tf * (x * sr - y * cr))**3
+            out[y, x] = A * G * T
+
+
 def tiltFactor(xy, f, tilt, rot, center=None):
     '''
     this function is extra to only cover vignetting through perspective distortion
@@ -60,12 +157,13 @@ if __name__ == '__main__':
              'cy': 50,
              'tilt': 0.2,
              'rot': 0.3}
-    vig = np.fromfunction(lambda y, x: vignetting((x, y), **param), (100, 150))
+    vig = vignetting_image((100, 150), **param)
 
     param = {'f': 150,
              'rot': 0,
              'tilt': np.radians(60)}
-    tilt = np.fromfunction(lambda y, x: tiltFactor((x, y), **param), (75, 75))
+    y, x = np.ogrid[:75, :75]
+    tilt = tiltFactor((x, y), **param)
 
     if 'no_window' not in sys.argv:
         plt.figure('vignetting')
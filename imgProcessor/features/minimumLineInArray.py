@@ -3,25 +3,49 @@ from __future__ import print_function
 
 import numpy as np
 from numba import jit
-from scipy.ndimage import center_of_mass
 
 
-@jit(nopython=True)
+@jit(nopython=True, cache=True)
 def _lineSumXY(x, res, sub, f):
+    # a numpy version gathering all rows at once: sub[rows, x].sum(axis=-1)
+    # was 6-10x slower for all tested sizes (s0=11...101, sx=50...100)
     s0 = sub.shape[0]
     sx = x.shape[0]
     hs = (s0 - 1) * 0.5
+    fhs = f / hs
+    # row index of every position of the current line:
+    rows = np.empty(sx, dtype=np.intp)
+    # position of the minimum:
+    best = np.inf
+    best_i = 0
+    best_j = 0
 
     for i in range(s0):
-        ff = 1 - f * (abs(i - hs) / hs)
+        ff = 1 - fhs * abs(i - hs)
         for j in range(s0):
-            c = float(i)
-            d = float(j - i) / sx
-            val = 0.0
+            # row position as 32.32 fixed point number
+            # step rounded to nearest -> drift < sx/2**33 rows:
+            d = (j - i) << 32
+            if d >= 0:
+                d = (d + sx // 2) // sx
+            else:
+                d = -((sx // 2 - d) // sx)
+            # +0.5, so that >>32 rounds to the nearest row
+            # +sx (> drift), so that exact halves always round up:
+            c = (i << 32) + (1 << 31) + sx
             for n in range(sx):
-                val += sub[int(round(c)), x[n]]
+                rows[n] = c >> 32
                 c += d
-            res[i, j] = val * ff
+            val = 0.0
+            for n in range(sx):
+                val += sub[rows[n], x[n]]
+            val *= ff
+            res[i, j] = val
+            if val < best:
+                best = val
+                best_i = i
+                best_j = j
+    return best_i, best_j
 
 
 def minimumLineInArray(arr, relative=False, f=0,
@@ -39,30 +63,29 @@ def minimumLineInArray(arr, relative=False, f=0,
     '''
     s0, s1 = arr.shape[:2]
     if max_pos >= s1:
-        x = np.arange(s1)
+        x = np.arange(s1, dtype=np.intp)
     else:
         # take fewer positions within 0->(s1-1)
-        x = np.rint(np.linspace(0, s1 - 1, min(max_pos, s1))).astype(int)
+        x = np.rint(np.linspace(0, s1 - 1, min(max_pos, s1))).astype(np.intp)
     res = np.empty((s0, s0), dtype=float)
 
-    _lineSumXY(x, res, arr, f)
+    # best integer index
+    i, j = _lineSumXY(x, res, arr, f)
 
     if return_pos_arr:
         return res
 
-    # best integer index
-    i, j = np.unravel_index(np.nanargmin(res), res.shape)
-
     if refinePosition:
-        try:
-            sub = res[i - 1:i + 2, j - 1:j + 2]
-            ii, jj = center_of_mass(sub)
-            if not np.isnan(ii):
-                i += (ii - 1)
-            if not np.isnan(jj):
-                j += (jj - 1)
-        except TypeError:
-            pass
+        sub = res[i - 1:i + 2, j - 1:j + 2]
+        # center of mass of the 3x3 neighbourhood:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s = sub.sum()
+            ii = sub.sum(axis=1).dot(np.arange(sub.shape[0])) / s
+            jj = sub.sum(axis=0).dot(np.arange(sub.shape[1])) / s
+        if not np.isnan(ii):
+            i += (ii - 1)
+        if not np.isnan(jj):
+            j += (jj - 1)
 
 
     if not relative:
@@ -1,68 +1,192 @@
 from __future__ import division
 
-from numba import jit
+from functools import lru_cache
+from numba import njit, prange
 import numpy as np
+from scipy.signal import oaconvolve
 
 
 
-def interpolate2dStructuredIDW(grid, mask, kernel=15, power=2, fx=1, fy=1):
+def interpolate2dStructuredIDW(grid, mask, kernel=15, power=2, fx=1, fy=1,
+                               eps=1e-4, dtype=np.float64, out=None,
+                               method='auto'):
     '''
     replace all values in [grid] indicated by [mask]
     with the inverse distance weighted interpolation of all values within 
     px+-kernel
     [power] -> distance weighting factor: 1/distance**[power]
+    [eps] -> ignore neighbours with weight < eps * weight of the closest
+             valid neighbour
+    [dtype] -> precision of weights and sums, np.float32 is faster
+    [out] -> write result to this array and leave [grid] unchanged
+    [method] -> 'loop': sum up neighbours of every masked pixel
+                'convolve': two FFT convolutions of the whole grid
+                            (ignores [eps])
+                'auto': 'convolve' if many pixels are masked,
+                        there is no cut-off and all unmasked values are
+                        finite (FFT would spread nan/inf), else 'loop'
 
     '''
-    weights = np.empty(shape=((2*kernel+1,2*kernel+1)))
-    for xi in range(-kernel,kernel+1):
-        for yi in range(-kernel,kernel+1):
-            dist = ((fx*xi)**2+(fy*yi)**2)
-            if dist:
-                weights[xi+kernel,yi+kernel] = 1 / dist**(0.5*power)
-
-    return _calc(grid, mask, kernel, weights)
-    
+    # ~mask needs a boolean array (e.g. not uint8 0/1):
+    mask = np.asarray(mask, dtype=bool)
+    dx, dy, weights, eps = _buildWeights(kernel, power, fx, fy, eps,
+                                         np.dtype(dtype))
+    if method == 'auto':
+        # convolution time doesn't depend on the number of masked pixels
+        # break-even was at ~50 summed neighbours per grid pixel:
+        method = 'loop'
+        if (not eps and (np.count_nonzero(mask) * len(weights)
+                         > _CONVOLVE_MIN * grid.size)
+                and np.isfinite(grid[~mask]).all()):
+            method = 'convolve'
+    elif method not in ('loop', 'convolve'):
+        raise ValueError("method must be 'auto', 'loop' or 'convolve'")
+
+    if out is None:
+        # in place:
+        out = grid
+    else:
+        out[...] = grid
+    if method == 'convolve':
+        return _calcConvolve(out, mask, dx, dy, weights, kernel)
+
+    # zero padded copies of values and validity [0, 1] of the grid
+    # so that neighbours can be read without bound or mask checks
+    # (valid is multiplied with the weights if there is no cut-off,
+    #  else only tested, where a small dtype saves cache):
+    k = kernel
+    gx, gy = grid.shape
+    valid = np.zeros((gx + 2 * k, gy + 2 * k),
+                     dtype=np.uint8 if eps else dtype)
+    valid[k:k + gx, k:k + gy] = ~mask
+    grid_z = np.zeros(valid.shape, dtype=dtype)
+    grid_z[k:k + gx, k:k + gy] = np.where(mask, 0, grid)
+
+    return _calc(out, mask, grid_z, valid, dx + k, dy + k, weights, eps,
+                 _TILE)
+
+
+@lru_cache(maxsize=32)
+def _buildWeights(kernel, power, fx, fy, eps, dtype):
+    '''
+    returns read-only flat arrays of all neighbour offsets dx, dy,
+    their weights and the effective cut-off [eps]
+    '''
+    xi, yi = np.mgrid[-kernel:kernel + 1, -kernel:kernel + 1]
+    if fx == fy:
+        # weights only depend on the integer squared distance,
+        # so evaluate pow() once per distance in a lookup table:
+        dist = xi**2 + yi**2
+        lut = np.empty(2 * kernel**2 + 1)
+        lut[1:] = (fx**2 * np.arange(1, lut.size))**(-0.5 * power)
+    else:
+        dist = (fx * xi)**2 + (fy * yi)**2
+    # exclude the center pixel:
+    ind = dist > 0
+    dx, dy, dist = xi[ind], yi[ind], dist[ind]
+    if fx == fy:
+        weights = lut[dist].astype(dtype)
+    else:
+        weights = (dist**(-0.5 * power)).astype(dtype)
+    if weights.size and weights.min() < eps * weights.max():
+        # sort neighbours by decreasing weight, so that _calc can stop
+        # at the first neighbour without significant contribution:
+        order = np.argsort(weights, kind='stable')[::-1]
+        dx, dy, weights = dx[order], dy[order], weights[order]
+    else:
+        # cut-off is never reached
+        eps = 0
+    for a in (dx, dy, weights):
+        a.setflags(write=False)
+    return dx, dy, weights, eps
+
+
+_CONVOLVE_MIN = 50
+
+
+def _calcConvolve(out, mask, dx, dy, weights, kernel):
+    '''
+    sum(w*value) and sum(w) of all valid neighbours
+    as convolutions with the 2d weight kernel
+    '''
+    if not weights.size:
+        return out
+    # always in float64: the FFT error scales with the largest value
+    # and float32 would be far less precise than the loop:
+    w2d = np.zeros((2 * kernel + 1, 2 * kernel + 1))
+    w2d[dx + kernel, dy + kernel] = weights
+    valid = (~mask).astype(np.float64)
+    value = oaconvolve(np.where(mask, 0, out).astype(np.float64), w2d,
+                       mode='same')
+    sumWi = oaconvolve(valid, w2d, mode='same')
+    # sumWi is either 0 or >= smallest weight (except FFT round-off):
+    ind = mask & (sumWi > 0.5 * weights.min())
+    out[ind] = value[ind] / sumWi[ind]
+    return out
+
+
+# size of the pixel blocks processed by one thread
+# neighbours of one block should fit in the cpu cache:
+_TILE = 32
     
-@jit(nopython=True)
-def _calc(grid, mask, kernel, weights):
-    gx = grid.shape[0]
-    gy = grid.shape[1]
     
-    #FOR EVERY PIXEL
-    for i in range(gx):
-        for j in range(gy):
-            
-            if mask[i,j]:
-                
-                xmn = i-kernel
-                if xmn < 0:
-                    xmn = 0
-                xmx = i+kernel
-                if xmx > gx:
-                    xmx = gx
-                    
-                ymn = j-kernel
-                if ymn < 0:
-                    ymn = 0
-                ymx = j+kernel
-                if ymx > gy:
-                    ymx = gy
-                    
-                sumWi = 0.0
-                value = 0.0 
-                c = 0
-                #FOR EVERY NEIGHBOUR IN KERNEL              
-                for xi in range(xmn,xmx+1):
-                    for yi in range(ymn,ymx+1):
-                        if  (xi != i or yi != j) and not mask[xi,yi]:
-                            wi = weights[xi-i+kernel,yi-j+kernel]
+# the flat per-neighbour weight table is read sequentially,
+# indexing a lookup table by squared distance (dx**2+dy**2) in _calc
+# was 1.4x slower (kernel=20, 600x600 grid)
+@njit(parallel=True, fastmath=True, cache=True)
+def _calc(out, mask, grid_z, valid, dx, dy, weights, eps, tile):
+    # all values are read from [grid_z], masked pixels are written to [out]
+    gx = out.shape[0]
+    gy = out.shape[1]
+    n = len(weights)
+    # sums in the precision of [weights]:
+    typ = weights.dtype.type
+    zero = typ(0)
+    eps = typ(eps)
+    # number of blocks in x, y:
+    bx = (gx + tile - 1) // tile
+    by = (gy + tile - 1) // tile
+
+    #FOR EVERY BLOCK
+    # (parallel: [out] is written, but only [grid_z] is read)
+    for b in prange(bx * by):
+        i0 = (b // by) * tile
+        j0 = (b % by) * tile
+        #FOR EVERY PIXEL IN BLOCK
+        for i in range(i0, min(i0 + tile, gx)):
+            for j in range(j0, min(j0 + tile, gy)):
+
+                if mask[i,j]:
+                    sumWi = zero
+                    value = zero
+                    #FOR EVERY NEIGHBOUR IN KERNEL
+                    # (dx, dy include padding offset)
+                    if eps:
+                        wcut = zero
+                        for k in range(n):
+                            if weights[k] < wcut:
+                                # remaining neighbours are less significant
+                                break
+                            xi = i + dx[k]
+                            yi = j + dy[k]
+                            if valid[xi,yi]:
+                                wi = weights[k]
+                                if not sumWi:
+                                    # first valid = closest neighbour
+                                    wcut = eps * wi
+                                sumWi += wi
+                                value += wi * grid_z[xi,yi]
+                    else:
+                        for k in range(n):
+                            xi = i + dx[k]
+                            yi = j + dy[k]
+                            wi = weights[k] * valid[xi,yi]
                             sumWi += wi
-                            value += wi * grid[xi,yi] 
-                        c += 1 
-                if sumWi:
-                    grid[i,j] = value / sumWi               
+                            value += wi * grid_z[xi,yi]
+                    if sumWi:
+                        out[i,j] = value / sumWi
 
-    return grid
+    return out
 
 
 
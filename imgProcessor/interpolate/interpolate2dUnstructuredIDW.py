@@ -1,36 +1,179 @@
 from __future__ import division
 
 import numpy as np
-from numba import njit
+from math import sqrt
+from numba import njit, prange, float32
+from scipy.spatial import cKDTree
+try:
+    from numba import cuda
+except ImportError:
+    cuda = None
 
 
-@njit
-def interpolate2dUnstructuredIDW(x, y, v, grid, power=2):
+def interpolate2dUnstructuredIDW(x, y, v, grid, power=2, eps=0,
+                                 k_neighbors=None, use_cuda=False,
+                                 dtype=np.float64):
     '''
     x,y,v --> 1d numpy.array
     grid --> 2d numpy.array
+    eps --> ignore points with a weight < eps * weight of the closest point
+            (eps=0: use all points)
+            needs an extra pass to find the closest point, so it only
+            pays off for powers other than 1, 2, 3 (e.g. eps=1e-4)
+    k_neighbors --> only use the k closest points of every pixel
+                    (found with a KD-tree, recommended for many points)
+    use_cuda --> calculate on the GPU (float32, no [eps] cut-off)
+    dtype --> precision of the calculation, np.float32 is faster
 
     fast if number of given values is small relative to grid resolution
     '''
-    n = len(v)
+    if k_neighbors:
+        return _calcKNN(x, y, v, grid, power, k_neighbors)
+    # one contiguous (x, y, value) record per point:
+    pts = np.column_stack((x, y, v)).astype(dtype)
+    if use_cuda:
+        return _calcCUDA(pts, grid, power)
+    # squared distance (relative to closest point) at which weight == eps:
+    r2_cut = eps**(-2 / power) if eps > 0 else np.inf
+    return _calc(pts, grid, power, r2_cut)
+
+
+def _calcKNN(x, y, v, grid, power, k):
+    gx, gy = grid.shape
+    v = np.asarray(v, dtype=np.float64)
+    k = min(k, len(v))
+    tree = cKDTree(np.column_stack((x, y)))
+    ii, jj = np.mgrid[:gx, :gy].reshape(2, -1)
+    d, idx = tree.query(np.column_stack((ii, jj)), k=k, workers=-1)
+    d = d.reshape(len(ii), k)
+    idx = idx.reshape(len(ii), k)
+    vals = v[idx]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w = 1 / d**power
+        out = (w * vals).sum(1) / w.sum(1)
+    # pixel position == point position:
+    over = d[:, 0] == 0
+    out[over] = vals[over, 0]
+    grid[:] = out.reshape(gx, gy)
+    return grid
+
+
+def _calcCUDA(pts, grid, power):
+    if cuda is None or not cuda.is_available():
+        raise Exception('no CUDA device available')
+    d_pts = cuda.to_device(pts.astype(np.float32))
+    d_grid = cuda.to_device(grid)
+    blocks = ((grid.shape[0] + _CUDA_BLOCK - 1) // _CUDA_BLOCK,
+              (grid.shape[1] + _CUDA_BLOCK - 1) // _CUDA_BLOCK)
+    _idwKernel[blocks, (_CUDA_BLOCK, _CUDA_BLOCK)](d_pts, d_grid, power)
+    d_grid.copy_to_host(grid)
+    return grid
+
+
+# threads per block = _CUDA_BLOCK**2
+_CUDA_BLOCK = 16
+_CUDA_NT = _CUDA_BLOCK * _CUDA_BLOCK
+
+
+if cuda is not None:
+    @cuda.jit(fastmath=True)
+    def _idwKernel(pts, grid, power):
+        # one thread per pixel:
+        i, j = cuda.grid(2)
+        t = cuda.threadIdx.x * _CUDA_BLOCK + cuda.threadIdx.y
+        inside = i < grid.shape[0] and j < grid.shape[1]
+        n = pts.shape[0]
+        e = float32(-0.5 * power)
+        # points are processed in chunks, copied to shared memory
+        # by all threads of the block:
+        sp = cuda.shared.array((_CUDA_NT, 3), float32)
+        overPx = False
+        vOver = float32(0)
+        sumWi = float32(0)
+        value = float32(0)
+        for k0 in range(0, n, _CUDA_NT):
+            if k0 + t < n:
+                sp[t, 0] = pts[k0 + t, 0]
+                sp[t, 1] = pts[k0 + t, 1]
+                sp[t, 2] = pts[k0 + t, 2]
+            cuda.syncthreads()
+            if inside and not overPx:
+                for k in range(min(_CUDA_NT, n - k0)):
+                    ddx = sp[k, 0] - i
+                    ddy = sp[k, 1] - j
+                    d2 = ddx * ddx + ddy * ddy
+                    if d2 == 0:
+                        overPx = True
+                        vOver = sp[k, 2]
+                        break
+                    if power == 2:
+                        wi = float32(1) / d2
+                    elif power == 1:
+                        wi = float32(1) / sqrt(d2)
+                    else:
+                        wi = d2**e
+                    sumWi += wi
+                    value += wi * sp[k, 2]
+            # wait before the next chunk overwrites shared memory:
+            cuda.syncthreads()
+        if inside:
+            if overPx:
+                grid[i, j] = vOver
+            else:
+                grid[i, j] = value / sumWi
+
+
+# a numpy broadcast over (n, gx, gy) was 3-8x slower than this loop
+# even for few points (n=5...30, grid 100x100...1000x2000)
+@njit(parallel=True, fastmath=True, cache=True)
+def _calc(pts, grid, power, r2_cut):
+    n = pts.shape[0]
     gx = grid.shape[0]
     gy = grid.shape[1]
-    for i in range(gx):
+    # all locals in the precision of [pts]:
+    typ = pts.dtype.type
+    zero = typ(0)
+    one = typ(1)
+    e = typ(-0.5 * power)
+    for i in prange(gx):
+        fi = typ(i)
         for j in range(gy):
+            fj = typ(j)
             overPx = False  # if pixel position == point position
-            sumWi = 0.0
-            value = 0.0
+            sumWi = zero
+            value = zero
+
+            cut = typ(np.inf)
+            if r2_cut < np.inf:
+                # squared distance to closest point:
+                for k in range(n):
+                    d2 = (pts[k, 0] - fi)**2 + (pts[k, 1] - fj)**2
+                    if d2 < cut:
+                        cut = d2
+                cut *= typ(r2_cut)
 
             for k in range(n):
-                xx = x[k]
-                yy = y[k]
-                vv = v[k]
-                if xx == i and yy == j:
+                xx = pts[k, 0]
+                yy = pts[k, 1]
+                vv = pts[k, 2]
+                if xx == fi and yy == fj:
                     grid[i, j] = vv
                     overPx = True
                     break
                 # weight from inverse distance:
-                wi = 1 / ((xx - i)**2 + (yy - j)**2)**(0.5 * power)
+                d2 = (xx - fi)**2 + (yy - fj)**2
+                # skip points without significant weight:
+                if d2 > cut:
+                    continue
+                # avoid pow() for common powers:
+                if power == 2:
+                    wi = one / d2
+                elif power == 1:
+                    wi = one / sqrt(d2)
+                elif power == 3:
+                    wi = one / (d2 * sqrt(d2))
+                else:
+                    wi = d2**e
                 sumWi += wi
                 value += wi * vv
             if not overPx: